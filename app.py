@@ -8,10 +8,20 @@ from __future__ import annotations
 import os
 import re
 import json
-from typing import Optional, Dict, Any
+import hashlib
+import shutil
+import statistics
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, replace
+from typing import Optional, Dict, Any, List, Tuple
 
 import streamlit as st
-import pandas as pd
+
+try:  # optional: much faster than sha256 for (non-cryptographic) cache keys
+    import xxhash  # type: ignore
+except ImportError:
+    xxhash = None
 
 import os
 os.environ["GRPC_VERBOSITY"] = "ERROR"
@@ -27,6 +37,164 @@ st.set_page_config(
 )
 
 
+# ----------------------------- Cached helpers ------------------------------
+def _content_key(data: bytes) -> str:
+    """Cache key for large blobs: xxh3-128 when available, else sha256."""
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+def _upload_key(upload: Any) -> str:
+    """_content_key of an UploadedFile, computed once per file_id (reruns reuse it)."""
+    keys: Dict[str, str] = st.session_state.setdefault("upload_keys", {})
+    key = keys.get(upload.file_id)
+    if key is None:
+        key = keys[upload.file_id] = _content_key(upload.getvalue())
+    return key
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _parse_pdf_cached(
+    pdf_hash: str,
+    dpi: int,
+    max_pages: Optional[int],
+    _upload: Any,
+    _ocr_workers: int = ae.OCR_MAX_WORKERS,
+) -> Dict[str, Any]:
+    """Parse an upload once per (content hash, OCR DPI, page cap); `_`-prefixed args are not hashed."""
+    # The upload is already in memory; spooling it to disk lets the extractors
+    # and pdf2image open the file by path rather than each wrapping the bytes.
+    tf = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+    try:
+        with tf:
+            _upload.seek(0)
+            shutil.copyfileobj(_upload, tf)
+        return ae.parse_pdf_smart_path(tf.name, dpi=dpi, max_pages=max_pages, ocr_workers=_ocr_workers)
+    finally:
+        os.unlink(tf.name)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _cached_audit(
+    text_hash: str,
+    ejari_json: str,
+    rera_index_aed: Optional[int],
+    _contract_text: str,
+    _ej: ae.EjariFields,
+) -> ae.AuditResult:
+    """Rule-based run_audit memoized on its inputs; the `_`-prefixed originals are not hashed.
+
+    AI audits bypass this cache: they draw a progress bar (Streamlit calls inside
+    a cached function are replayed on hits and cannot reach an outside element),
+    their verdicts are already cached on disk per clause, and errored clauses
+    must be retried on the next run.
+    """
+    return ae.run_audit(_contract_text, _ej, rera_index_aed=rera_index_aed)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _load_articles(articles_key: str, _upload: Any) -> List[str]:
+    """Reference texts from the AI articles CSV, read once per content key; `_upload` is not hashed.
+
+    cache_resource shares one list across reruns/sessions (no pickle copy of a
+    large article set); run_audit only reads it.
+    """
+    _upload.seek(0)
+    return ae.read_articles_texts_from_csv(_upload)
+
+
+# Only the lookup columns are read; repeated text keys load as categories.
+RERA_CSV_COLUMNS = ("city", "community", "property_type", "bedrooms", "index_aed")
+RERA_CSV_DTYPES = {"city": "category", "property_type": "category"}
+
+# (has_city, has_property_type, has_bedrooms, has_community), and
+# (city, property_type, bedrooms) → [(community, index_aed), …]. A key part is
+# None when the CSV lacks that column, so that filter is skipped; a community
+# is None for blank cells (never matches a community filter).
+ReraIndex = Tuple[Tuple[bool, bool, bool, bool], Dict[tuple, List[tuple]]]
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _load_rera_index(csv_key: str, _upload: Any) -> ReraIndex:
+    """Read the RERA index CSV once per content key and group it for O(1) lookups.
+
+    `_upload` is not hashed. cache_resource shares the dict without a pickle
+    round-trip; callers only read it.
+    """
+    import pandas as pd  # deferred: only needed once a RERA CSV is uploaded
+
+    _upload.seek(0)
+    df = pd.read_csv(_upload, usecols=lambda c: c in RERA_CSV_COLUMNS, dtype=RERA_CSV_DTYPES)
+    n = len(df)
+    cols = set(df.columns)
+    cities = df["city"].astype(str).str.lower().tolist() if "city" in cols else [None] * n
+    ptypes = df["property_type"].astype(str).str.lower().tolist() if "property_type" in cols else [None] * n
+    # Blank / non-numeric bedrooms ("Studio", "") become NaN and those rows are
+    # skipped, instead of one bad cell failing every lookup.
+    beds = pd.to_numeric(df["bedrooms"], errors="coerce").tolist() if "bedrooms" in cols else [None] * n
+    if "community" in cols:
+        comm_col = df["community"]
+        comms = comm_col.astype(str).str.lower().where(comm_col.notna(), None).tolist()
+    else:
+        comms = [None] * n
+    groups: Dict[tuple, List[tuple]] = {}
+    for (city, ptype, bed), comm, aed in zip(zip(cities, ptypes, beds), comms, df["index_aed"].tolist()):
+        if aed != aed or bed != bed:  # skip NaN index values / unusable bedrooms
+            continue
+        key = (city, ptype, None if bed is None else int(bed))
+        groups.setdefault(key, []).append((comm, aed))
+    flags = ("city" in cols, "property_type" in cols, "bedrooms" in cols, "community" in cols)
+    return flags, groups
+
+
+def _rera_lookup(index: ReraIndex, city: str, ptype: str, beds: int, comm: str) -> Optional[int]:
+    """Median index_aed of the rows matching the Ejari fields (None if nothing matches)."""
+    (has_city, has_ptype, has_beds, has_comm), groups = index
+    key = (
+        str(city).lower() if has_city else None,
+        str(ptype).lower() if has_ptype else None,
+        int(beds) if has_beds else None,
+    )
+    comm_l = (comm or "").lower() if has_comm else ""
+    # Blank CSV communities (None) are excluded once a community filter is set
+    matches = [aed for c, aed in groups.get(key, ()) if not comm_l or (c is not None and comm_l in c)]
+    if not matches:
+        return None
+    # use median if several rows
+    return int(float(statistics.median(matches)))
+
+
+@st.cache_resource(show_spinner=False)
+def _firebase_init_cached(creds_key: str, _payload: bytes) -> bool:
+    """Initialize Firestore once per service-account payload (process-wide); `_payload` is not hashed."""
+    ae.firebase_init_from_bytes(_payload)
+    return True
+
+
+@st.cache_resource
+def _ledger_executor() -> ThreadPoolExecutor:
+    """Process-wide pool for Firestore ledger writes (kept off the request path)."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="ledger")
+
+
+def _report_ledger_writes() -> None:
+    """Toast the outcome of background ledger writes that finished since the last rerun."""
+    pending: List[Future] = st.session_state.get("ledger_futures", [])
+    still_running = []
+    for fut in pending:
+        if not fut.done():
+            still_running.append(fut)
+        elif fut.exception() is not None:
+            st.toast(f"Failed to write Firestore ledger: {fut.exception()}", icon="⚠️")
+        else:
+            st.toast(f"Ledger entry written ✓ (agreement id: {fut.result()})", icon="✅")
+    st.session_state.ledger_futures = still_running
+
+
+_report_ledger_writes()
+
+
 # ----------------------------- Sidebar: Firestore --------------------------
 with st.sidebar:
     st.header("Cloud & Index")
@@ -39,20 +207,42 @@ with st.sidebar:
             if "firebase" in st.secrets:
                 ae.firebase_init_from_mapping(dict(st.secrets["firebase"]))
             elif os.environ.get("FIREBASE_SERVICE_ACCOUNT_JSON"):
-                ae.firebase_init_from_json_string(os.environ["FIREBASE_SERVICE_ACCOUNT_JSON"])
+                creds = os.environ["FIREBASE_SERVICE_ACCOUNT_JSON"].encode("utf-8")
+                _firebase_init_cached(_content_key(creds), creds)
             elif os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"):
                 ae.firebase_init_from_file(os.environ["GOOGLE_APPLICATION_CREDENTIALS"])
             elif svc_upload is not None:
-                ae.firebase_init_from_bytes(svc_upload.read())
+                # getvalue() does not consume the upload, so a second click still sees the JSON
+                creds = svc_upload.getvalue()
+                _firebase_init_cached(_content_key(creds), creds)
             else:
                 raise RuntimeError("No credentials in secrets/env/upload.")
             st.success("Firestore initialized ✓")
         except Exception as e:
             st.error(f"Firestore init failed: {e}")
 
-    if ae.firebase_available():
+    # Read once per run, after any init above; the audit fragment reuses it.
+    fb_ok = ae.firebase_available()
+    if fb_ok:
         st.info("Firestore: **connected**")
 
+    st.markdown("---")
+    st.subheader("PDF parsing")
+    ocr_dpi = st.slider(
+        "OCR DPI", 150, 400, ae.OCR_DPI, step=50,
+        help="Only used for scanned PDFs. Lower is faster; 200 is enough for typed contracts.",
+    )
+    max_pages = st.number_input(
+        "Max pages to read", min_value=0, value=0, step=1,
+        help="0 reads the whole PDF. Otherwise only the first N pages are extracted/OCRed; "
+        "clauses on later pages are not audited.",
+    )
+    cpu_count = os.cpu_count() or 1
+    ocr_workers = st.slider(
+        "OCR workers", 1, cpu_count, min(ae.OCR_MAX_WORKERS, cpu_count),
+        help="Scanned pages OCRed in parallel (one Tesseract process each).",
+    ) if cpu_count > 1 else 1
+
     st.markdown("---")
     st.subheader("RERA index (CSV upload)")
     st.caption("Optional CSV with columns like: `city,community,property_type,bedrooms,index_aed`.")
@@ -67,6 +257,10 @@ with st.sidebar:
     st.subheader("AI Layer (Gemini)")
     st.caption("Optional — checks each clause against reference texts.")
     use_ai = st.checkbox("Enable AI clause checks (Gemini)", value=False)
+    ai_concurrency = st.slider(
+        "Parallel AI requests", 1, 16, ae.AI_MAX_CONCURRENCY,
+        help="How many clauses are checked against Gemini at once. Lower it if you hit rate limits.",
+    )
     # Prefer Streamlit secrets for key; fallback to input/env
     ai_api_key = None
     try:
@@ -82,13 +276,12 @@ with st.sidebar:
     else:
         ai_api_key = st.text_input("Gemini API Key", value=os.environ.get("GEMINI_API_KEY", ""), type="password")
     ai_csv = st.file_uploader("Upload reference CSV (articles_export.csv)", type=["csv"], key="ai_csv")
-    ai_csv_temp_path = None
+    # Parsed in memory once per distinct CSV and handed to the engine as a list
+    ai_articles_key: Optional[str] = None
+    ai_articles: Optional[List[str]] = None
     if ai_csv is not None:
-        # Persist to a temp file for engine consumption
-        import tempfile
-        fd, ai_csv_temp_path = tempfile.mkstemp(prefix="articles_", suffix=".csv")
-        with os.fdopen(fd, "wb") as f:
-            f.write(ai_csv.read())
+        ai_articles_key = _upload_key(ai_csv)
+        ai_articles = _load_articles(ai_articles_key, ai_csv)
 
 # ----------------------------- Main: Upload --------------------------------
 st.title("Dubai Rental Contract Auditor — Ejari + OCR + RERA CSV")
@@ -101,16 +294,35 @@ with cols[0]:
     pdf_text = ""
     ejari_prefill = ae.EjariFields()
     parse_notes = []
+    pages_truncated = False
+    pdf_page_count: Optional[int] = None
+    # Only the PDF's digest lives in the session (never its bytes); drop it once
+    # the file is removed from (or replaced in) the uploader.
+    prev_file_id = st.session_state.get("pdf_file_id")
+    if prev_file_id is not None and (up is None or up.file_id != prev_file_id):
+        st.session_state.get("upload_keys", {}).pop(prev_file_id, None)
+        del st.session_state.pdf_file_id
     if up is not None:
-        b = up.read()
-        parsed = ae.parse_pdf_smart(b)
+        st.session_state.pdf_file_id = up.file_id
+        pdf_hash = _upload_key(up)  # hashed once per file_id; the bytes stay in the uploader
+        # Only parse when the PDF (or OCR settings) changed since the last parse;
+        # widget interactions rerun the script against the same sticky upload.
+        parse_key = (pdf_hash, ocr_dpi, int(max_pages) or None)
+        if st.session_state.get("last_parsed_hash") != parse_key:
+            st.session_state.last_parsed = _parse_pdf_cached(*parse_key, up, ocr_workers)
+            st.session_state.last_parsed_hash = parse_key
+        parsed = st.session_state.last_parsed
         pdf_text = parsed["text"] or ""
         ejari_prefill = parsed["ejari"]
         parse_notes = parsed["notes"]
+        pages_truncated = parsed.get("pages_truncated", False)
+        pdf_page_count = parsed.get("page_count")
         if parsed.get("ocr_used"):
             st.success("OCR fallback used.")
         st.success("PDF text extracted.")
         st.info("Ejari-style fields detected and parsed.")
+        for note in parse_notes:
+            st.caption(note)
 
 with cols[1]:
     st.subheader("Contract Text (editable)")
@@ -129,10 +341,26 @@ with cols[1]:
     )
 
 # ----------------------------- Form fields ---------------------------------
+# Selectbox options as tuples plus value → index maps (no list scans per rerun)
+CITIES = ("Dubai", "Abu Dhabi", "Sharjah")
+PROPERTY_TYPES = ("apartment", "villa", "townhouse")
+PROPERTY_TYPE_IDX = {v: i for i, v in enumerate(PROPERTY_TYPES)}
+FURNISHINGS = ("unfurnished", "semi-furnished", "furnished")
+FURNISHING_IDX = {v: i for i, v in enumerate(FURNISHINGS)}
+
+# Longest clause text shown per row in the results table
+CLAUSE_PREVIEW_CHARS = 300
+
+# Citations pulled from clause issues into the table's "law" column
+LAW_CITATION_RE = re.compile(r"(Law\s+\d+/\d+)", re.IGNORECASE)
+DECREE_CITATION_RE = re.compile(r"(Decree\s+\d+/\d{4})", re.IGNORECASE)
+
 st.markdown("---")
 st.subheader("Extracted / Editable Ejari fields")
 
 def _ejari_to_widgets(e: ae.EjariFields) -> Dict[str, Any]:
+    # Dates are coerced to `date` here, once; the date widgets keep them as
+    # `date`, so readers of st.session_state.ejari use them as-is.
     return {
         "city": e.city or "Dubai",
         "community": e.community or "",
@@ -151,55 +379,59 @@ def _ejari_to_widgets(e: ae.EjariFields) -> Dict[str, Any]:
 if "ejari" not in st.session_state:
     st.session_state.ejari = _ejari_to_widgets(ejari_prefill)
 
-# If new upload changed parsed values, sync once
-if up is not None:
+# If new upload changed parsed values, sync once (per parse, not per rerun)
+if up is not None and st.session_state.get("ejari_prefill_key") != st.session_state.last_parsed_hash:
     parsed_w = _ejari_to_widgets(ejari_prefill)
     # Merge: only overwrite blank fields
     for k, v in parsed_w.items():
         if not st.session_state.ejari.get(k):
             st.session_state.ejari[k] = v
-
-form1 = st.columns(2)
-with form1[0]:
-    st.session_state.ejari["city"] = st.selectbox("City", ["Dubai", "Abu Dhabi", "Sharjah"], index=0)
-    st.session_state.ejari["community"] = st.text_input("Area / Community", value=st.session_state.ejari["community"])
-    st.session_state.ejari["bedrooms"] = st.number_input("Bedrooms", min_value=0, max_value=15, value=int(st.session_state.ejari["bedrooms"]), step=1)
-    st.session_state.ejari["security_deposit_aed"] = st.number_input("Security Deposit (AED)", min_value=0, value=int(st.session_state.ejari["security_deposit_aed"]), step=1000)
-with form1[1]:
-    st.session_state.ejari["property_type"] = st.selectbox("Property Type", ["apartment", "villa", "townhouse"], index=["apartment", "villa", "townhouse"].index(st.session_state.ejari["property_type"]))
-    st.session_state.ejari["current_annual_rent_aed"] = st.number_input("Current Annual Rent (AED)", min_value=0, value=int(st.session_state.ejari["current_annual_rent_aed"]), step=1000)
-    st.session_state.ejari["proposed_new_rent_aed"] = st.number_input("Proposed New Rent (AED)", min_value=0, value=int(st.session_state.ejari["proposed_new_rent_aed"]), step=1000)
-
-form2 = st.columns(2)
-with form2[0]:
-    st.session_state.ejari["renewal_date"] = st.date_input("Renewal Date", value=ae.to_date(st.session_state.ejari.get("renewal_date")))
-    st.session_state.ejari["ejari_contact"] = st.text_input("Ejari Contact Number (optional)", value=st.session_state.ejari.get("ejari_contact", ""))
-with form2[1]:
-    st.session_state.ejari["notice_sent_date"] = st.date_input("Notice Sent Date", value=ae.to_date(st.session_state.ejari.get("notice_sent_date")))
-    st.session_state.ejari["furnishing"] = st.selectbox("Furnishing", ["unfurnished", "semi-furnished", "furnished"],
-                                                        index=["unfurnished", "semi-furnished", "furnished"].index(st.session_state.ejari["furnishing"]))
+    st.session_state.ejari_prefill_key = st.session_state.last_parsed_hash
+
+# Batch edits in a form: widget changes only rerun the page (RERA lookup,
+# caches, …) once a submit button is pressed, not on every keystroke/click.
+# Edits reach st.session_state.ejari only on submit, so the form has its own
+# "update + audit" button; the standalone "Run audit now" uses the last
+# submitted values.
+with st.form("ejari_form"):
+    form1 = st.columns(2)
+    with form1[0]:
+        st.session_state.ejari["city"] = st.selectbox("City", CITIES, index=0)
+        st.session_state.ejari["community"] = st.text_input("Area / Community", value=st.session_state.ejari["community"])
+        st.session_state.ejari["bedrooms"] = st.number_input("Bedrooms", min_value=0, max_value=15, value=int(st.session_state.ejari["bedrooms"]), step=1)
+        st.session_state.ejari["security_deposit_aed"] = st.number_input("Security Deposit (AED)", min_value=0, value=int(st.session_state.ejari["security_deposit_aed"]), step=1000)
+    with form1[1]:
+        st.session_state.ejari["property_type"] = st.selectbox("Property Type", PROPERTY_TYPES, index=PROPERTY_TYPE_IDX.get(st.session_state.ejari["property_type"], 0))
+        st.session_state.ejari["current_annual_rent_aed"] = st.number_input("Current Annual Rent (AED)", min_value=0, value=int(st.session_state.ejari["current_annual_rent_aed"]), step=1000)
+        st.session_state.ejari["proposed_new_rent_aed"] = st.number_input("Proposed New Rent (AED)", min_value=0, value=int(st.session_state.ejari["proposed_new_rent_aed"]), step=1000)
+
+    form2 = st.columns(2)
+    with form2[0]:
+        st.session_state.ejari["renewal_date"] = st.date_input("Renewal Date", value=st.session_state.ejari["renewal_date"])
+        st.session_state.ejari["ejari_contact"] = st.text_input("Ejari Contact Number (optional)", value=st.session_state.ejari.get("ejari_contact", ""))
+    with form2[1]:
+        st.session_state.ejari["notice_sent_date"] = st.date_input("Notice Sent Date", value=st.session_state.ejari["notice_sent_date"])
+        st.session_state.ejari["furnishing"] = st.selectbox("Furnishing", FURNISHINGS,
+                                                            index=FURNISHING_IDX.get(st.session_state.ejari["furnishing"], 0))
+    submit_cols = st.columns(2)
+    with submit_cols[0]:
+        st.form_submit_button("Update fields")
+    with submit_cols[1]:
+        if st.form_submit_button("Update fields & run audit", type="primary"):
+            st.session_state.audit_requested = True
 
 # ----------------------------- RERA CSV lookup -----------------------------
 rera_index_aed: Optional[int] = None
 if rera_csv is not None:
     try:
-        df = pd.read_csv(rera_csv)
-        # naive filter
-        city = st.session_state.ejari["city"]
-        comm = st.session_state.ejari["community"]
-        ptype = st.session_state.ejari["property_type"]
-        beds = int(st.session_state.ejari["bedrooms"])
-        q = df.copy()
-        for col, val in [("city", city), ("property_type", ptype)]:
-            if col in q.columns:
-                q = q[q[col].astype(str).str.lower() == str(val).lower()]
-        if "bedrooms" in q.columns:
-            q = q[q["bedrooms"].astype(int) == beds]
-        if "community" in q.columns and comm:
-            q = q[q["community"].astype(str).str.contains(comm, case=False, na=False)]
-        if not q.empty:
-            # use median if several rows
-            rera_index_aed = int(float(q["index_aed"].median()))
+        rera_index_aed = _rera_lookup(
+            _load_rera_index(_upload_key(rera_csv), rera_csv),
+            st.session_state.ejari["city"],
+            st.session_state.ejari["property_type"],
+            int(st.session_state.ejari["bedrooms"]),
+            st.session_state.ejari["community"],
+        )
+        if rera_index_aed is not None:
             st.success(f"RERA index (CSV) match: **AED {rera_index_aed:,}**")
         else:
             st.info("No row matched in your CSV. You can still audit with 0 as index.")
@@ -208,123 +440,176 @@ if rera_csv is not None:
 
 # ----------------------------- Run Audit -----------------------------------
 st.markdown("---")
-if st.button("Run audit now"):
-    # Build EjariFields back
-    ej = ae.EjariFields(
-        city=st.session_state.ejari["city"],
-        community=st.session_state.ejari["community"],
-        property_type=st.session_state.ejari["property_type"],
-        bedrooms=int(st.session_state.ejari["bedrooms"]),
-        security_deposit_aed=int(st.session_state.ejari["security_deposit_aed"]),
-        current_annual_rent_aed=int(st.session_state.ejari["current_annual_rent_aed"]),
-        proposed_new_rent_aed=int(st.session_state.ejari["proposed_new_rent_aed"]),
-        furnishing=st.session_state.ejari["furnishing"],
-        renewal_date=ae.to_date(st.session_state.ejari["renewal_date"]),
-        notice_sent_date=ae.to_date(st.session_state.ejari["notice_sent_date"]),
-        ejari_contact=st.session_state.ejari.get("ejari_contact") or None,
-    )
 
-    res = ae.run_audit(
-        st.session_state.contract_text or "",
-        ej,
-        rera_index_aed=rera_index_aed,
-        use_ai=use_ai,
-        ai_api_key=ai_api_key,
-        ai_articles_csv_path=ai_csv_temp_path,
-    )
 
-    # Header verdict
-    if res.verdict == "pass":
-        st.success("PASS — No blocking issues found.")
-    else:
-        st.error("FAIL — Issues found.")
-
-    # Show single summary metric: number of failed clauses
-    failed_count = sum(1 for c in res.clause_findings if c.verdict == "fail")
-    st.metric("Failed clauses", f"{failed_count}")
-
-    # Clauses table (from text)
-    st.markdown("### 📌 Clause verdicts (from your PDF terms)")
-    data = [{
-        "clause": c.clause_no,
-        "text": c.text,
-        "verdict": c.verdict,
-        "issues": c.issues,
-    } for c in res.clause_findings]
-
-    # Build DataFrame with a separate 'law' column parsed from issues
-    df = pd.DataFrame(data)
-
-    def _extract_law(s: str) -> str:
-        if not isinstance(s, str) or not s:
-            return ""
-        m = re.search(r"(Law\s+\d+/\d+)", s, re.IGNORECASE)
-        if m:
-            return m.group(1)
-        d = re.search(r"(Decree\s+\d+/\d{4})", s, re.IGNORECASE)
-        if d:
-            return d.group(1)
-        return ""
-
-    if "issues" in df.columns:
-        df["law"] = df["issues"].apply(_extract_law)
-        # Trim issues to keep table readable; full text still visible via dataframe cell expansion
-        df["issues"] = df["issues"].astype(str).apply(lambda t: t if len(t) <= 200 else t[:199] + "…")
-
-    # Reorder columns: clause, verdict, law, text, issues
-    cols_order = [c for c in ["clause", "verdict", "law", "text", "issues"] if c in df.columns]
-    df = df[cols_order]
-
-    # Horizontally scrollable container and tuned column widths
-    st.markdown("<div style='overflow-x:auto;'>", unsafe_allow_html=True)
-    try:
-        st.dataframe(
-            df,
-            width='stretch',
-            hide_index=True,
-            column_config={
-                "clause": st.column_config.NumberColumn("clause", width="small"),
-                "verdict": st.column_config.TextColumn("verdict", width="small"),
-                "law": st.column_config.TextColumn("law", width="small"),
-                "text": st.column_config.TextColumn("text", width="large"),
-                "issues": st.column_config.TextColumn("issues", width="large"),
-            },
+@st.fragment
+def _audit_fragment() -> None:
+    """Run-audit button + results; clicking it reruns only this fragment, not the whole page."""
+    # Fragment reruns skip the module-level poll, so report finished ledger writes here too.
+    _report_ledger_writes()
+    run_now = st.button("Run audit now")
+    st.caption("Audits the fields as last updated; unsaved edits in the form above are ignored.")
+    if run_now or st.session_state.pop("audit_requested", False):
+        # Build EjariFields back
+        ej = ae.EjariFields(
+            city=st.session_state.ejari["city"],
+            community=st.session_state.ejari["community"],
+            property_type=st.session_state.ejari["property_type"],
+            bedrooms=int(st.session_state.ejari["bedrooms"]),
+            security_deposit_aed=int(st.session_state.ejari["security_deposit_aed"]),
+            current_annual_rent_aed=int(st.session_state.ejari["current_annual_rent_aed"]),
+            proposed_new_rent_aed=int(st.session_state.ejari["proposed_new_rent_aed"]),
+            furnishing=st.session_state.ejari["furnishing"],
+            renewal_date=st.session_state.ejari["renewal_date"],
+            notice_sent_date=st.session_state.ejari["notice_sent_date"],
+            ejari_contact=st.session_state.ejari.get("ejari_contact") or None,
         )
-    except TypeError:
-        # Backward-compat for Streamlit versions expecting integer width or use_container_width
-        st.dataframe(
-            df,
-            use_container_width=True,
-            hide_index=True,
-            column_config={
-                "clause": st.column_config.NumberColumn("clause", width="small"),
-                "verdict": st.column_config.TextColumn("verdict", width="small"),
-                "law": st.column_config.TextColumn("law", width="small"),
-                "text": st.column_config.TextColumn("text", width="large"),
-                "issues": st.column_config.TextColumn("issues", width="large"),
-            },
-        )
-    st.markdown("</div>", unsafe_allow_html=True)
-
-    st.markdown("### Text findings")
-    for t in res.text_findings:
-        st.write("•", t)
 
-    if res.issues:
-        st.markdown("### Issues summary")
-        for i in res.issues:
-            st.write("•", i)
-
-    # Write ledger if Firestore is ready
-    if ae.firebase_available():
+        contract_text = st.session_state.contract_text or ""
+        if use_ai:
+            # Live progress for the AI layer; cleared once the audit returns
+            ai_bar = st.progress(0.0, text="AI clause checks…")
+
+            def _ai_progress(done: int, total: int) -> None:
+                ai_bar.progress(done / total, text=f"AI checked {done}/{total} clauses")
+
+            res = ae.run_audit(
+                contract_text,
+                ej,
+                rera_index_aed=rera_index_aed,
+                use_ai=True,
+                ai_api_key=ai_api_key,
+                ai_articles_memory=ai_articles,
+                progress=_ai_progress,
+                ai_concurrency=ai_concurrency,
+            )
+            ai_bar.empty()
+        else:
+            res = _cached_audit(
+                _content_key(contract_text.encode("utf-8")),
+                json.dumps(asdict(ej), sort_keys=True, default=str),
+                rera_index_aed,
+                contract_text,
+                ej,
+            )
+        # A cache hit returns the earlier result; stamp it with this run for the ledger.
+        res = replace(res, timestamp=ae.now_iso())
+
+        # Header verdict
+        if res.verdict == "pass" and res.ai_errors:
+            st.warning(f"PASS (rule-based only) — AI layer could not check {res.ai_errors} clause(s); see issues below.")
+        elif res.verdict == "pass":
+            st.success("PASS — No blocking issues found.")
+        else:
+            st.error("FAIL — Issues found.")
+        if pages_truncated:
+            st.warning(
+                f"Only the first {int(max_pages)} of {pdf_page_count} PDF pages were audited. "
+                "Set “Max pages to read” (sidebar) to 0 to check the whole contract."
+            )
+
+        # Collect the table columns in one pass (dict-of-lists skips per-row dict
+        # inference); the metric below counts from the same verdict list.
+        # Clause text is sent as a preview to keep the Arrow payload small; the
+        # full text stays in the editable contract text above.
+        clauses, texts, verdicts, issues = [], [], [], []
+        for c in res.clause_findings:
+            clauses.append(c.clause_no)
+            texts.append(c.text if len(c.text) <= CLAUSE_PREVIEW_CHARS else c.text[: CLAUSE_PREVIEW_CHARS - 1] + "…")
+            verdicts.append(c.verdict)
+            issues.append(c.issues)
+
+        # Show single summary metric: number of failed clauses
+        failed_count = verdicts.count("fail")
+        st.metric("Failed clauses", f"{failed_count}")
+
+        # Clauses table (from text)
+        st.markdown("### 📌 Clause verdicts (from your PDF terms)")
+
+        import pandas as pd  # deferred: only needed once an audit has run
+
+        # Build DataFrame with a separate 'law' column parsed from issues
+        # Typed columns up front: int32 clause numbers, and verdict (three values)
+        # as an ordered categorical (int8 codes)
+        df = pd.DataFrame({
+            "clause": pd.Series(clauses, dtype="int32"),
+            "text": texts,
+            "verdict": pd.Categorical(verdicts, categories=["pass", "warn", "fail"], ordered=True),
+            "issues": issues,
+        })
+
+        if "issues" in df.columns:
+            iss = df["issues"].astype(str)
+            # First "Law N/N" citation, else first "Decree N/YYYY" (vectorized, no per-row apply)
+            law = iss.str.extract(LAW_CITATION_RE, expand=False)
+            df["law"] = law.fillna(iss.str.extract(DECREE_CITATION_RE, expand=False)).fillna("")
+            # Trim issues to keep table readable; full text still visible via dataframe cell expansion
+            df["issues"] = iss.where(iss.str.len() <= 200, iss.str.slice(0, 199) + "…")
+
+        # Reorder columns: clause, verdict, law, text, issues
+        cols_order = [c for c in ["clause", "verdict", "law", "text", "issues"] if c in df.columns]
+        # Text columns go to Arrow-backed strings (one contiguous buffer per column
+        # instead of boxed Python objects; handed to st.dataframe without conversion)
+        df = df[cols_order].astype({c: "string[pyarrow]" for c in ("law", "text", "issues") if c in cols_order})
+
+        # Horizontally scrollable container and tuned column widths
+        st.markdown("<div style='overflow-x:auto;'>", unsafe_allow_html=True)
         try:
-            tenant = "tenant@example.com"
-            landlord = "landlord@example.com"
-            pdf_bytes = up.getvalue() if up is not None else None
-            agreement_id = ae.write_ledger(tenant, landlord, ej, res, pdf_bytes=pdf_bytes, rera_index_aed=rera_index_aed)
-            st.success(f"Ledger entry written ✓  (agreement id: `{agreement_id}`)")
-        except Exception as e:
-            st.error(f"Failed to write Firestore ledger: {e}")
+            st.dataframe(
+                df,
+                width='stretch',
+                hide_index=True,
+                column_config={
+                    "clause": st.column_config.NumberColumn("clause", width="small"),
+                    "verdict": st.column_config.TextColumn("verdict", width="small"),
+                    "law": st.column_config.TextColumn("law", width="small"),
+                    "text": st.column_config.TextColumn("text", width="large"),
+                    "issues": st.column_config.TextColumn("issues", width="large"),
+                },
+            )
+        except TypeError:
+            # Backward-compat for Streamlit versions expecting integer width or use_container_width
+            st.dataframe(
+                df,
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "clause": st.column_config.NumberColumn("clause", width="small"),
+                    "verdict": st.column_config.TextColumn("verdict", width="small"),
+                    "law": st.column_config.TextColumn("law", width="small"),
+                    "text": st.column_config.TextColumn("text", width="large"),
+                    "issues": st.column_config.TextColumn("issues", width="large"),
+                },
+            )
+        st.markdown("</div>", unsafe_allow_html=True)
+
+        st.markdown("### Text findings")
+        for t in res.text_findings:
+            st.write("•", t)
+
+        if res.issues:
+            st.markdown("### Issues summary")
+            for i in res.issues:
+                st.write("•", i)
+
+        # Write ledger if Firestore is ready; the write runs in the background and
+        # its outcome is toasted on the next page or fragment rerun (see _report_ledger_writes).
+        if fb_ok:
+            try:
+                tenant = "tenant@example.com"
+                landlord = "landlord@example.com"
+                # Read from the uploader only now; the session never holds a copy.
+                pdf_bytes = up.getvalue() if up is not None else None
+                fut = _ledger_executor().submit(
+                    ae.write_ledger, tenant, landlord, ej, res, pdf_bytes=pdf_bytes, rera_index_aed=rera_index_aed
+                )
+                st.session_state.setdefault("ledger_futures", []).append(fut)
+                st.info("Saving ledger entry to Firestore in the background…")
+            except Exception as e:
+                st.error(f"Failed to write Firestore ledger: {e}")
+
+
+_audit_fragment()
 
 # ----------------------------- Footnotes -----------------------------------
 st.markdown("---")
@@ -334,9 +619,4 @@ st.caption(
 )
 
 # Optional: show extractor used (debug)
-st.caption(
-    "Extractor: "
-    + ("pdfminer" if getattr(ae, "_pdfminer_ok", False)
-       else "pypdf" if getattr(ae, "_pypdf_ok", False)
-       else "none")
-)
\ No newline at end of file
+st.caption("Extractor: " + getattr(ae, "PDF_EXTRACTOR", "none"))
@@ -8,78 +8,353 @@ from __future__ import annotations
 
 import io
 import os
+import importlib.util
 import re
 import json
 import hashlib
+import random
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 from dataclasses import dataclass, asdict
 from datetime import datetime, date
-from typing import Optional, List, Dict, Tuple, Any
+from typing import Optional, List, Dict, Tuple, Any, Callable
 
 from dateutil.parser import parse as dtparse
 
+def _module_available(name: str) -> bool:
+    """Locate an optional dependency without importing it (keeps module import cheap)."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except Exception:
+        return False
+
+
 # ----------------------------- Optional Gemini -----------------------------
-_gemini_ok = False
-try:
-    import google.generativeai as genai  # type: ignore
-    _gemini_ok = True
-except Exception:
-    _gemini_ok = False
+# Imported on first AI check; the SDK pulls in grpc/protobuf.
+_gemini_ok = _module_available("google.generativeai")
+
+# Clauses are judged concurrently (each call is network-bound, so threads are
+# enough); transient API errors are retried with exponential backoff + jitter.
+AI_MAX_CONCURRENCY = 10
+AI_MAX_RETRIES = 3
+AI_BACKOFF_BASE_S = 1.0
+
+
+def _retry_with_backoff(
+    fn: Any,
+    retries: int = AI_MAX_RETRIES,
+    base_delay: float = AI_BACKOFF_BASE_S,
+    retry_on: Tuple[type, ...] = (Exception,),
+) -> Any:
+    """Call fn(); on a `retry_on` exception sleep base_delay * 2**attempt (+ jitter) and retry.
+
+    The last error (or any exception outside `retry_on`) is re-raised.
+    """
+    for attempt in range(retries):
+        try:
+            return fn()
+        except retry_on:
+            if attempt == retries - 1:
+                raise
+            time.sleep(base_delay * (2 ** attempt) + random.uniform(0, base_delay))
+
+
+# Exact-match on-disk cache of AI clause verdicts, so re-running an audit after
+# small edits only pays for clauses (or article sets) that actually changed.
+# Best effort: any sqlite error just means a cache miss / skipped write.
+# Lives next to this module unless LLM_CACHE_PATH is set in the environment;
+# roughly the newest LLM_CACHE_MAX_ROWS writes are kept (trimmed every
+# LLM_CACHE_TRIM_EVERY writes). One shared connection, guarded by a lock, serves
+# all threads, so concurrent clause checks never contend for the file lock.
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "llm_cache.sqlite3"
+)
+LLM_CACHE_MAX_ROWS = 20_000
+LLM_CACHE_TRIM_EVERY = 256
+
+_llm_cache_lock = threading.Lock()
+_llm_cache_conn: Optional[sqlite3.Connection] = None
+_llm_cache_writes = 0
+
+
+def _llm_cache_db() -> sqlite3.Connection:
+    """Shared connection; the schema is created on first use. Call with _llm_cache_lock held."""
+    global _llm_cache_conn
+    if _llm_cache_conn is None:
+        os.makedirs(os.path.dirname(LLM_CACHE_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(LLM_CACHE_PATH, timeout=5.0, check_same_thread=False)
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        _llm_cache_conn = conn
+    return _llm_cache_conn
+
+
+def _llm_cache_get(key: str) -> Optional[Tuple[str, str, List[int]]]:
+    try:
+        with _llm_cache_lock:
+            row = _llm_cache_db().execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        verdict, reason, refs = json.loads(row[0])
+        return verdict, reason, refs
+    except Exception:
+        return None
+
+
+def _llm_cache_put(key: str, result: Tuple[str, str, List[int]]) -> Tuple[str, str, List[int]]:
+    """Store `result` under `key` and hand it back (so callers can `return _llm_cache_put(...)`)."""
+    global _llm_cache_writes
+    try:
+        with _llm_cache_lock:
+            conn = _llm_cache_db()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO llm_cache (key, value) VALUES (?, ?)", (key, json.dumps(result)))
+                _llm_cache_writes += 1
+                if _llm_cache_writes % LLM_CACHE_TRIM_EVERY == 0:
+                    # REPLACE re-inserts at the end, so rowid order is write order: drop the oldest.
+                    conn.execute(
+                        "DELETE FROM llm_cache WHERE rowid <= (SELECT MAX(rowid) FROM llm_cache) - ?",
+                        (LLM_CACHE_MAX_ROWS,),
+                    )
+    except Exception:
+        pass
+    return result
 
 # ----------------------------- PDF Extraction -----------------------------
-# Prefer pdfminer for layout; fallback to PyPDF (no system deps).
-_pdfminer_ok = False
-_pypdf_ok = False
+# Prefer the C-backed parsers (PyMuPDF, then PDFium) for born-digital PDFs;
+# fallback to pdfminer for layout, then PyPDF (no system deps).
+# Every extractor accepts either the raw PDF bytes or a filesystem path; a
+# path lets the parsers read the file lazily instead of holding a
+# second in-memory copy of large uploads.
+# Backends are only probed here and imported on first use, so importing
+# audit_engine does not pay for pdfminer/PyMuPDF/etc. up front.
+_pymupdf_ok = _module_available("fitz")
+_pdfium_ok = _module_available("pypdfium2")
+_pdfminer_ok = _module_available("pdfminer")
+_pypdf_ok = _module_available("pypdf")
+
+
+def _as_stream(src: bytes | str) -> Any:
+    """Wrap raw bytes in a BytesIO; paths are passed through untouched."""
+    return io.BytesIO(src) if isinstance(src, (bytes, bytearray)) else src
+
+
+def _pymupdf_extract_text(src: bytes | str, max_pages: Optional[int] = None) -> str:
+    import fitz  # type: ignore  # PyMuPDF
+
+    if isinstance(src, (bytes, bytearray)):
+        doc = fitz.open(stream=src, filetype="pdf")
+    else:
+        doc = fitz.open(src)
+    try:
+        n = doc.page_count if max_pages is None else min(max_pages, doc.page_count)
+        return "\n".join(doc[i].get_text("text") for i in range(n))
+    finally:
+        doc.close()
 
-try:
-    from pdfminer.high_level import extract_text as _pdfminer_extract_text  # type: ignore
-    _pdfminer_ok = True
-except Exception:
-    _pdfminer_ok = False
 
-try:
-    import pypdf  # type: ignore
+def _pdfium_extract_text(src: bytes | str, max_pages: Optional[int] = None) -> str:
+    import pypdfium2 as pdfium  # type: ignore
 
-    def _pypdf_extract_text(pdf_bytes: bytes) -> str:
-        reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+    pdf = pdfium.PdfDocument(src)
+    try:
+        n = len(pdf) if max_pages is None else min(max_pages, len(pdf))
         out = []
-        for page in reader.pages:
-            out.append(page.extract_text() or "")
+        for i in range(n):
+            out.append(pdf[i].get_textpage().get_text_range() or "")
         return "\n".join(out)
+    finally:
+        pdf.close()
+
+
+def _pdfminer_extract_text(src: bytes | str, max_pages: Optional[int] = None) -> str:
+    from pdfminer.high_level import extract_text  # type: ignore
+
+    return extract_text(_as_stream(src), maxpages=max_pages or 0)  # 0 = all pages
+
+
+def _pypdf_extract_text(src: bytes | str, max_pages: Optional[int] = None) -> str:
+    import pypdf  # type: ignore
+
+    reader = pypdf.PdfReader(_as_stream(src))
+    out = []
+    for page in islice(reader.pages, max_pages):
+        out.append(page.extract_text() or "")
+    return "\n".join(out)
 
-    _pypdf_ok = True
-except Exception:
-    _pypdf_ok = False
+
+def _pdf_page_count(src: bytes | str) -> Optional[int]:
+    """Total page count via the first backend that can open the PDF; None if none can."""
+    if _pymupdf_ok:
+        try:
+            import fitz  # type: ignore
+
+            doc = fitz.open(stream=src, filetype="pdf") if isinstance(src, (bytes, bytearray)) else fitz.open(src)
+            try:
+                return doc.page_count
+            finally:
+                doc.close()
+        except Exception:
+            pass
+    if _pdfium_ok:
+        try:
+            import pypdfium2 as pdfium  # type: ignore
+
+            pdf = pdfium.PdfDocument(src)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+        except Exception:
+            pass
+    if _pypdf_ok:
+        try:
+            import pypdf  # type: ignore
+
+            return len(pypdf.PdfReader(_as_stream(src)).pages)
+        except Exception:
+            pass
+    return None
 
 
-def _extract_text_any(pdf_bytes: bytes) -> str:
-    """Try pdfminer first, then PyPDF. Return empty string if both fail."""
+# Preferred backend, in the same order _extract_text_any tries them (shown in the UI footer).
+PDF_EXTRACTOR = (
+    "pymupdf" if _pymupdf_ok
+    else "pypdfium2" if _pdfium_ok
+    else "pdfminer" if _pdfminer_ok
+    else "pypdf" if _pypdf_ok
+    else "none"
+)
+
+
+def _extract_text_any(src: bytes | str, max_pages: Optional[int] = None) -> str:
+    """Try PyMuPDF, PDFium, pdfminer, then PyPDF. Return empty string if all fail.
+
+    `max_pages` caps how many leading pages are read (None = whole document).
+    The next backend is only tried when one raises: an empty result from a
+    parser that opened the PDF means a scanned document, so it goes straight
+    to OCR instead of paying for a slow pdfminer pass that finds nothing too.
+    """
+    if _pymupdf_ok:
+        try:
+            return _pymupdf_extract_text(src, max_pages)
+        except Exception:
+            pass
+    if _pdfium_ok:
+        try:
+            return _pdfium_extract_text(src, max_pages)
+        except Exception:
+            pass
     if _pdfminer_ok:
         try:
-            return _pdfminer_extract_text(io.BytesIO(pdf_bytes))
+            return _pdfminer_extract_text(src, max_pages)
         except Exception:
             pass
     if _pypdf_ok:
         try:
-            return _pypdf_extract_text(pdf_bytes)
+            return _pypdf_extract_text(src, max_pages)
         except Exception:
             pass
     return ""
 
 
 # Optional OCR (works locally; not on Streamlit Cloud)
-def _ocr_pdf_to_text(pdf_bytes: bytes) -> str:
+# 200 DPI is plenty for typed A4 contracts; render cost and Tesseract time
+# both scale with pixel count, so this is ~2.25x cheaper than 300 DPI.
+OCR_DPI = 200
+
+# Extracted text with at least this many letters is treated as born-digital;
+# only near-empty extractions (image/scanned PDFs) pay for OCR.
+OCR_MIN_ALPHA_CHARS = 50
+
+# Tesseract runs as a subprocess, so threads OCR pages in parallel without
+# GIL contention. LSTM engine + "single uniform block" layout suits contracts.
+OCR_MAX_WORKERS = 8
+OCR_TESSERACT_CONFIG = "--oem 1 --psm 6"
+
+
+# Each Tesseract process starts its own OpenMP pool; with several pages OCRed
+# at once that oversubscribes the CPU, so parallel OCR pins it to one thread.
+# pytesseract passes no env to its subprocess, so the variable is set
+# process-wide while any parallel OCR runs (unless the user already set it).
+_OMP_LIMIT_PRESET = "OMP_THREAD_LIMIT" in os.environ
+_omp_lock = threading.Lock()
+_omp_users = 0
+
+
+@contextmanager
+def _single_threaded_tesseract() -> Any:
+    """Set OMP_THREAD_LIMIT=1 while the block runs (refcounted across concurrent OCR calls)."""
+    global _omp_users
+    if _OMP_LIMIT_PRESET:  # user-provided value: leave it alone
+        yield
+        return
+    with _omp_lock:
+        if _omp_users == 0:
+            os.environ["OMP_THREAD_LIMIT"] = "1"
+        _omp_users += 1
+    try:
+        yield
+    finally:
+        with _omp_lock:
+            _omp_users -= 1
+            if _omp_users == 0:
+                os.environ.pop("OMP_THREAD_LIMIT", None)
+
+
+def _has_native_text(text: str, min_alpha: int = OCR_MIN_ALPHA_CHARS) -> bool:
+    """True once `text` contains `min_alpha` alphabetic characters (stops counting early)."""
+    n = 0
+    for ch in text:
+        if ch.isalpha():
+            n += 1
+            if n >= min_alpha:
+                return True
+    return False
+
+
+def _ocr_pdf_to_text(
+    src: bytes | str,
+    dpi: int = OCR_DPI,
+    max_pages: Optional[int] = None,
+    max_workers: int = OCR_MAX_WORKERS,
+) -> str:
     """Attempt OCR (requires poppler + tesseract). Return '' if unavailable."""
     try:
-        from pdf2image import convert_from_bytes  # type: ignore
+        from pdf2image import convert_from_bytes, convert_from_path  # type: ignore
         import pytesseract  # type: ignore
         from PIL import Image  # type: ignore
 
-        images = convert_from_bytes(pdf_bytes)
-        texts = []
-        for im in images:
+        # Grayscale TIFF: lossless (fewer Tesseract errors than JPEG) and a
+        # third of the pixel bytes of RGB.
+        render = dict(dpi=dpi, grayscale=True, thread_count=1, fmt="tiff")
+        if max_pages is not None:
+            render["last_page"] = max_pages
+        if isinstance(src, (bytes, bytearray)):
+            images = convert_from_bytes(src, **render)
+        else:
+            images = convert_from_path(src, **render)
+        if not images:
+            return ""
+
+        def _ocr_page(im: Any) -> str:
             if not isinstance(im, Image.Image):
                 im = im.convert("RGB")
-            texts.append(pytesseract.image_to_string(im))
+            return pytesseract.image_to_string(im, config=OCR_TESSERACT_CONFIG)
+
+        workers = max(1, min(max_workers, os.cpu_count() or 1, len(images)))
+        if workers == 1:
+            texts = [_ocr_page(im) for im in images]
+        else:
+            with _single_threaded_tesseract(), ThreadPoolExecutor(max_workers=workers) as pool:
+                texts = list(pool.map(_ocr_page, images))  # map() keeps page order
         return "\n".join(texts)
     except Exception:
         return ""
@@ -103,8 +378,15 @@ def to_date(value: str | date | None) -> date:
         return date(2025, 12, 1)
     if isinstance(value, date):
         return value
+    s = str(value)
+    # Fast path for ISO-style YYYY-MM-DD / YYYY/MM/DD (widgets, JSON, Ejari forms)
+    if len(s) >= 10 and s[4] in "-/" and s[7] in "-/" and (len(s) == 10 or s[10] in "T "):
+        try:
+            return date(int(s[:4]), int(s[5:7]), int(s[8:10]))
+        except ValueError:
+            pass
     try:
-        return dtparse(str(value)).date()
+        return dtparse(s).date()
     except Exception:
         return date(2025, 12, 1)
 
@@ -139,7 +421,8 @@ def parse_pct(text: str | None, default: float = 0.0) -> float:
 
 
 def clean_lines(block: str) -> List[str]:
-    return [ln.strip() for ln in (block or "").splitlines() if ln.strip()]
+    # strip each line once (map runs str.strip in C), then drop empties
+    return [ln for ln in map(str.strip, (block or "").splitlines()) if ln]
 
 
 def read_articles_texts_from_csv(obj: Any) -> List[str]:
@@ -176,22 +459,103 @@ def read_articles_texts_from_csv(obj: Any) -> List[str]:
     return texts
 
 
-def _rank_articles_by_overlap(clause: str, articles: List[str], top_k: int = 50) -> List[Tuple[int, str]]:
-    """Return list of (global_index, article_text) ranked by token overlap with clause."""
+_TOKEN_RE = re.compile(r"[a-zA-Z']{3,}")
+
+
+def _tokenize(text: str) -> set:
+    return set(_TOKEN_RE.findall(str(text).lower()))
+
+
+def _build_article_index(articles: List[str]) -> Dict[str, List[int]]:
+    """Inverted index token -> article indices, built once per audit instead of per clause."""
+    index: Dict[str, List[int]] = {}
+    for idx, art in enumerate(articles):
+        for tok in _tokenize(art):
+            index.setdefault(tok, []).append(idx)
+    return index
+
+
+def _articles_digest(articles: List[str]) -> str:
+    """Stable fingerprint of an article set (part of the AI verdict cache key)."""
+    h = hashlib.sha256()
+    for art in articles:
+        h.update(str(art).encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+def _rank_articles_by_overlap(
+    clause: str,
+    articles: List[str],
+    top_k: int = 50,
+    index: Optional[Dict[str, List[int]]] = None,
+) -> List[Tuple[int, str]]:
+    """Return list of (global_index, article_text) ranked by token overlap with clause.
+
+    Pass a prebuilt `index` (see _build_article_index) when ranking many clauses
+    against the same articles; ranking then only touches the clause's tokens.
+    """
     if not clause or not articles:
         return []
-    clause_tokens = set(re.findall(r"[a-zA-Z']{3,}", clause.lower()))
-    scored: List[Tuple[int, float]] = []
-    for idx, art in enumerate(articles):
-        toks = set(re.findall(r"[a-zA-Z']{3,}", str(art).lower()))
-        if not toks:
-            continue
-        overlap = len(clause_tokens & toks) / float(len(clause_tokens) + 1e-9)
-        if overlap > 0:
-            scored.append((idx, overlap))
-    scored.sort(key=lambda x: x[1], reverse=True)
-    selected = [(i, articles[i]) for i, _ in scored[:top_k]]
-    return selected
+    if index is None:
+        index = _build_article_index(articles)
+    hits: Counter = Counter()
+    for tok in _tokenize(clause):
+        hits.update(index.get(tok, ()))
+    # overlap = shared tokens / clause tokens, so shared count orders the same;
+    # ties keep article order.
+    ranked = sorted(hits, key=lambda i: (-hits[i], i))
+    return [(i, articles[i]) for i in ranked[:top_k]]
+
+
+AI_SYSTEM_PROMPT = (
+    "You are a compliance checker for Dubai tenancy clauses. Given a clause and a set of reference legal/guidance texts, "
+    "decide if the clause appears non-compliant or problematic. Respond with a single line: 'FAIL - <reason>' if any reference suggests it is disallowed or risky; otherwise 'PASS - OK'."
+)
+AI_RESPONSE_FORMAT = (
+    "Return strict JSON only with keys: verdict ('FAIL'|'PASS'), reason (string), refs (array of integers referencing the indices above)."
+)
+# Part of every LLM cache key: editing either prompt text invalidates cached verdicts.
+_AI_PROMPT_DIGEST = hashlib.sha256(f"{AI_SYSTEM_PROMPT}|{AI_RESPONSE_FORMAT}".encode("utf-8")).hexdigest()[:16]
+
+
+# genai.configure() sets process-global SDK state that every model's client
+# reads, so requests for one key must not overlap a switch to another. Calls
+# with the configured key run concurrently; a different key waits for them to
+# drain, then reconfigures the SDK and rebuilds the models. The key is not
+# validated up front: a bad one just fails its own requests.
+_gemini_cond = threading.Condition()
+_gemini_api_key: Optional[str] = None
+_gemini_in_flight = 0
+
+
+def _gemini_generate(api_key: str, model_name: str, prompt: str) -> Any:
+    """generate_content(prompt) on the shared model, with the SDK configured for `api_key`."""
+    global _gemini_api_key, _gemini_in_flight
+    with _gemini_cond:
+        while _gemini_api_key != api_key and _gemini_in_flight:
+            _gemini_cond.wait()
+        if _gemini_api_key != api_key:
+            import google.generativeai as genai  # type: ignore
+
+            genai.configure(api_key=api_key)
+            _gemini_model_for.cache_clear()
+            _gemini_api_key = api_key
+        _gemini_in_flight += 1
+    try:
+        return _gemini_model_for(model_name).generate_content(prompt)
+    finally:
+        with _gemini_cond:
+            _gemini_in_flight -= 1
+            _gemini_cond.notify_all()
+
+
+@lru_cache(maxsize=4)
+def _gemini_model_for(model_name: str) -> Any:
+    """Build the model once per name (per configured key), shared by all clause checks."""
+    import google.generativeai as genai  # type: ignore
+
+    return genai.GenerativeModel(model_name)
 
 
 def _gemini_check_clause_against_articles(
@@ -201,28 +565,42 @@ def _gemini_check_clause_against_articles(
     model_name: str = "gemini-1.5-flash",
     batch_size: int = 20,
     start_index: int = 0,
+    article_index: Optional[Dict[str, List[int]]] = None,
+    articles_digest: Optional[str] = None,
 ) -> Tuple[str, str, List[int]]:
-    """Return (verdict, reason, refs) where verdict is 'pass' or 'fail'.
+    """Return (verdict, reason, refs) where verdict is 'pass', 'fail' or 'warn'.
+
+    'warn' means the clause could not be checked (init/request error); `reason`
+    carries the error.
 
     refs contains 0-based indices into the full `articles` list that the model
     indicates as relevant violations. We enumerate items to make extraction easy.
+    Completed verdicts are cached on disk (see LLM_CACHE_PATH); pass a precomputed
+    `articles_digest` (see _articles_digest) when checking many clauses.
     """
     if not (_gemini_ok and api_key and articles):
         return "pass", "AI check skipped (missing API, library, or articles).", []
 
+    if articles_digest is None:
+        articles_digest = _articles_digest(articles)
+    cache_key = hashlib.sha256(
+        f"{model_name}|{_AI_PROMPT_DIGEST}|{batch_size}|{start_index}|{articles_digest}|{clause}".encode("utf-8")
+    ).hexdigest()
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(model_name)
+        from google.api_core import exceptions as gexc  # type: ignore
     except Exception as e:
-        return "pass", f"AI init failed: {e}", []
+        return "warn", f"AI init failed: {e}", []
 
-    system_prompt = (
-        "You are a compliance checker for Dubai tenancy clauses. Given a clause and a set of reference legal/guidance texts, "
-        "decide if the clause appears non-compliant or problematic. Respond with a single line: 'FAIL - <reason>' if any reference suggests it is disallowed or risky; otherwise 'PASS - OK'."
-    )
+    # Only quota/availability errors are worth waiting out; a bad key, invalid
+    # argument or blocked prompt fails the same way on every attempt.
+    transient = (gexc.ResourceExhausted, gexc.ServiceUnavailable, gexc.DeadlineExceeded, gexc.InternalServerError)
 
     # Preselect relevant articles to reduce noise
-    ranked = _rank_articles_by_overlap(clause, articles, top_k=200)
+    ranked = _rank_articles_by_overlap(clause, articles, top_k=200, index=article_index)
     if not ranked:
         ranked = list(enumerate(articles))
 
@@ -233,15 +611,13 @@ def _gemini_check_clause_against_articles(
             idx = start_index + gidx
             numbered.append(f"[{idx}] {str(a).strip()[:2000]}")
         joined = "\n" + "\n".join(numbered)
-        prompt = (
-            f"{system_prompt}\n\nClause:\n{clause}\n\nReference texts (indexed):{joined}\n\n"
-            "Return strict JSON only with keys: verdict ('FAIL'|'PASS'), reason (string), refs (array of integers referencing the indices above)."
-        )
+        prompt = f"{AI_SYSTEM_PROMPT}\n\nClause:\n{clause}\n\nReference texts (indexed):{joined}\n\n{AI_RESPONSE_FORMAT}"
         try:
-            resp = model.generate_content(prompt)
+            resp = _retry_with_backoff(lambda: _gemini_generate(api_key, model_name, prompt), retry_on=transient)
             txt = (getattr(resp, "text", None) or "").strip()
         except Exception as e:
-            return "pass", f"AI request error: {e}", []
+            # Not cached: the clause is re-checked on the next audit.
+            return "warn", f"AI request error: {e}", []
 
         # Parse JSON strictly; fallback to heuristic
         verdict = "PASS"
@@ -262,9 +638,9 @@ def _gemini_check_clause_against_articles(
                 refs = [int(x) for x in m]
 
         if verdict == "FAIL":
-            return "fail", reason, refs
+            return _llm_cache_put(cache_key, ("fail", reason, refs))
 
-    return "pass", "No conflicts detected by AI layer", []
+    return _llm_cache_put(cache_key, ("pass", "No conflicts detected by AI layer", []))
 
 
 # ----------------------------- Data Models --------------------------------
@@ -305,6 +681,7 @@ class AuditResult:
     notes: List[str]
     contract_text: str
     timestamp: str
+    ai_errors: int = 0  # clauses whose AI check errored (verdict "warn", not cleared)
 
 
 # ----------------------------- PDF Parsing --------------------------------
@@ -322,6 +699,11 @@ EJARI_KEYS = {
 }
 
 TERMS_ANCHOR = re.compile(r"(?:Terms?\s*&\s*Conditions?|^Terms\s*:\s*$)", re.IGNORECASE)
+DATE_RE = re.compile(r"\d{4}[-/]\d{1,2}[-/]\d{1,2}")
+RENEWAL_RE = re.compile(r"Renewal|Renewal Date|End Date", re.IGNORECASE)
+LABEL_SEP_RE = re.compile(r"[:\-–]")
+DIGIT_RE = re.compile(r"\+?\d")
+WS_RE = re.compile(r"\s+")
 
 
 def parse_ejari_text(text: str) -> EjariFields:
@@ -332,8 +714,12 @@ def parse_ejari_text(text: str) -> EjariFields:
     lines = clean_lines(text)
     fields = EjariFields()
 
-    # 1) Shallow scans for obvious labels
-    for ln in lines:
+    # Single pass: each line is visited once; the numbered blocks below
+    # touch disjoint fields, so their relative order does not matter.
+    for i, ln in enumerate(lines):
+        low = ln.lower()
+
+        # 1) Shallow scans for obvious labels
         if "Annual Rent" in ln:
             fields.current_annual_rent_aed = parse_aed(ln, fields.current_annual_rent_aed)
         if "Security Deposit" in ln:
@@ -343,44 +729,41 @@ def parse_ejari_text(text: str) -> EjariFields:
             if m:
                 fields.bedrooms = int(m.group(0))
         if "Property Type" in ln:
-            if "villa" in ln.lower():
+            if "villa" in low:
                 fields.property_type = "villa"
-            elif "townhouse" in ln.lower():
+            elif "townhouse" in low:
                 fields.property_type = "townhouse"
             else:
                 fields.property_type = "apartment"
         if "Location" in ln or "Area:" in ln:
             # take everything after colon
-            parts = re.split(r"[:\-–]", ln, maxsplit=1)
+            parts = LABEL_SEP_RE.split(ln, maxsplit=1)
             if len(parts) == 2 and len(parts[1].strip()) > 1:
                 fields.community = parts[1].strip()
-        if "Ejari" in ln and ("Contact" in ln or "Helpline" in ln or re.search(r"\+?\d", ln)):
+        if "Ejari" in ln and ("Contact" in ln or "Helpline" in ln or DIGIT_RE.search(ln)):
             m = EJARI_CONTACT_RE.search(ln)
             if m:
-                fields.ejari_contact = re.sub(r"\s+", " ", m.group(1)).strip()
+                fields.ejari_contact = WS_RE.sub(" ", m.group(1)).strip()
 
-    # 2) Dates: try to infer period lines
-    for ln in lines:
+        # 2) Dates: try to infer period lines
         if "Contract Period" in ln or "From" in ln and "To" in ln:
             # extract two dates
-            ds = re.findall(r"\d{4}[-/]\d{1,2}[-/]\d{1,2}", ln)
+            ds = DATE_RE.findall(ln)
             if len(ds) >= 1:
                 fields.start_date = to_date(ds[0])
             if len(ds) >= 2:
                 fields.end_date = to_date(ds[1])
 
-    # 3) RERA-ish clauses sometimes include renewal or notice hints
-    for ln in lines:
-        if re.search(r"Renewal|Renewal Date|End Date", ln, re.I):
-            m = re.search(r"\d{4}[-/]\d{1,2}[-/]\d{1,2}", ln)
-            if m:
-                fields.renewal_date = to_date(m.group(0))
-        if "notice" in ln.lower() and re.search(r"\d{4}[-/]\d{1,2}[-/]\d{1,2}", ln):
-            fields.notice_sent_date = to_date(re.search(r"\d{4}[-/]\d{1,2}[-/]\d{1,2}", ln).group(0))
+        # 3) RERA-ish clauses sometimes include renewal or notice hints
+        dm = DATE_RE.search(ln)
+        if dm:
+            if RENEWAL_RE.search(ln):
+                fields.renewal_date = to_date(dm.group(0))
+            if "notice" in low:
+                fields.notice_sent_date = to_date(dm.group(0))
 
-    # 4) Proposed new rent (if present in free text)
-    for ln in lines[:40]:  # header region is enough
-        if "Proposed" in ln and "Rent" in ln:
+        # 4) Proposed new rent (if present in free text); header region is enough
+        if i < 40 and "Proposed" in ln and "Rent" in ln:
             fields.proposed_new_rent_aed = parse_aed(ln, fields.proposed_new_rent_aed)
 
     # defaults
@@ -390,25 +773,27 @@ def parse_ejari_text(text: str) -> EjariFields:
     return fields
 
 
-def parse_pdf_smart(pdf_bytes: bytes) -> Dict[str, Any]:
-    """
-    Extract text from PDF using pdfminer or PyPDF; OCR fallback when available.
-    Also attempts to extract Ejari-like fields for form prefill.
-    """
+def _parse_pdf_source(
+    src: bytes | str,
+    dpi: int = OCR_DPI,
+    max_pages: Optional[int] = None,
+    ocr_workers: int = OCR_MAX_WORKERS,
+) -> Dict[str, Any]:
+    """Shared body of parse_pdf_smart / parse_pdf_smart_path."""
     notes: List[str] = []
     text = ""
     try:
-        text = _extract_text_any(pdf_bytes)
+        text = _extract_text_any(src, max_pages)
         if not text.strip():
             notes.append("No extractable text (may be a scanned PDF).")
     except Exception as e:
         notes.append(f"PDF text extraction error: {e}")
         text = ""
 
-    # OCR fallback
+    # OCR fallback (skipped whenever native extraction produced real text)
     ocr_used = False
-    if len(text.strip()) < 120:
-        ocr = _ocr_pdf_to_text(pdf_bytes)
+    if not _has_native_text(text):
+        ocr = _ocr_pdf_to_text(src, dpi=dpi, max_pages=max_pages, max_workers=ocr_workers)
         if ocr and len(ocr.strip()) > len(text.strip()):
             text = ocr
             ocr_used = True
@@ -416,8 +801,53 @@ def parse_pdf_smart(pdf_bytes: bytes) -> Dict[str, Any]:
         else:
             notes.append("OCR not available or yielded too little text.")
 
+    # Say so when the page cap cut the document short: later clauses are unscanned.
+    page_count = _pdf_page_count(src) if max_pages else None
+    pages_truncated = bool(page_count and page_count > max_pages)
+    if pages_truncated:
+        notes.append(f"Read {max_pages} of {page_count} pages (page cap); clauses on later pages were not checked.")
+
     ejari = parse_ejari_text(text)
-    return {"text": text, "ejari": ejari, "ocr_used": ocr_used, "notes": notes}
+    return {
+        "text": text,
+        "ejari": ejari,
+        "ocr_used": ocr_used,
+        "notes": notes,
+        "page_count": page_count,
+        "pages_truncated": pages_truncated,
+    }
+
+
+def parse_pdf_smart(
+    pdf_bytes: bytes,
+    dpi: int = OCR_DPI,
+    max_pages: Optional[int] = None,
+    ocr_workers: int = OCR_MAX_WORKERS,
+) -> Dict[str, Any]:
+    """
+    Extract text from PDF using PyMuPDF, PDFium, pdfminer or PyPDF; OCR fallback when available.
+    Also attempts to extract Ejari-like fields for form prefill.
+    `dpi` is the render resolution used for OCR; `max_pages` limits extraction
+    (and OCR) to the first N pages, None reads the whole document.
+    `ocr_workers` caps how many pages Tesseract processes in parallel.
+    When the cap drops pages, "pages_truncated" is True and `notes` says how
+    many of "page_count" pages were read.
+    """
+    return _parse_pdf_source(pdf_bytes, dpi=dpi, max_pages=max_pages, ocr_workers=ocr_workers)
+
+
+def parse_pdf_smart_path(
+    path: str,
+    dpi: int = OCR_DPI,
+    max_pages: Optional[int] = None,
+    ocr_workers: int = OCR_MAX_WORKERS,
+) -> Dict[str, Any]:
+    """
+    Same as parse_pdf_smart, but reads the PDF from disk. Extractors open the
+    file themselves and OCR renders via pdf2image.convert_from_path, so large
+    uploads never need to be materialized as one bytes object.
+    """
+    return _parse_pdf_source(path, dpi=dpi, max_pages=max_pages, ocr_workers=ocr_workers)
 
 
 # ----------------------------- RERA Helpers -------------------------------
@@ -427,6 +857,11 @@ def compute_proposed_increase_pct(current_aed: int, proposed_aed: int) -> float:
     return round(((proposed_aed - current_aed) / float(current_aed)) * 100.0, 2)
 
 
+# Decree 43/2013 slab table: upper gap bound (inclusive) → max increase %.
+RERA_SLAB_GAP_BOUNDS = (10.0, 20.0, 30.0, 40.0)
+RERA_SLAB_MAX_PCTS = (0.0, 5.0, 10.0, 15.0, 20.0)
+
+
 def rera_slabs_max_increase(current_vs_index_gap_pct: float) -> float:
     """
     Implements Decree 43/2013 slabs (commonly summarized):
@@ -437,15 +872,7 @@ def rera_slabs_max_increase(current_vs_index_gap_pct: float) -> float:
       - >40% below → up to 20%
     """
     gap = max(0.0, current_vs_index_gap_pct)
-    if gap <= 10:
-        return 0.0
-    if gap <= 20:
-        return 5.0
-    if gap <= 30:
-        return 10.0
-    if gap <= 40:
-        return 15.0
-    return 20.0
+    return RERA_SLAB_MAX_PCTS[bisect_left(RERA_SLAB_GAP_BOUNDS, gap)]
 
 
 def estimate_gap_vs_index(current_aed: int, rera_index_aed: Optional[int]) -> float:
@@ -483,26 +910,45 @@ ILLEGAL_PATTERNS = [
     (re.compile(r"(?i)penalt(y|ies).*(tenant)"), "Penalty clauses must be reasonable, transparent, and specific.", "warn"),
 ]
 
+# Every rule fused into one alternation of named groups (p0, p1, ...). Most
+# contract lines match no rule and are cleared with a single search. On a
+# hit, `lastgroup` names a rule that fires; only rules listed before it can
+# still take priority, so just those are re-checked.
+_ILLEGAL_ANY_RE = re.compile(
+    "|".join(f"(?P<p{i}>{rx.pattern.replace('(?i)', '', 1)})" for i, (rx, _, _) in enumerate(ILLEGAL_PATTERNS)),
+    re.IGNORECASE,
+)
+
 NOTICE_MIN_DAYS = 90  # 90-day notice before renewal for rent changes (practice reflected in RERA comms)
 
 
 def scan_clauses(contract_text: str) -> List[ClauseFinding]:
     """Run rule-based scans over the free text for clearly illegal/iffy clauses."""
-    lines = [ln.strip() for ln in clean_lines(contract_text)]
+    return _scan_clauses(contract_text)[0]
+
+
+def _scan_clauses(contract_text: str) -> Tuple[List[ClauseFinding], bool]:
+    """scan_clauses body; also returns any_fail so run_audit need not re-walk the findings."""
+    # clean_lines already strips, and every rule is case-insensitive, so each
+    # line is matched as-is (no per-line strip/lower copies).
     findings: List[ClauseFinding] = []
-    cnum = 1
-    for ln in lines:
+    append = findings.append
+    any_fail = False
+    for cnum, ln in enumerate(clean_lines(contract_text), start=1):
         verdict = "pass"
         issues = ""
-        lowered = ln.lower()
-        for rx, msg, sev in ILLEGAL_PATTERNS:
-            if rx.search(lowered):
-                verdict = sev
-                issues = msg
-                break
-        findings.append(ClauseFinding(clause_no=cnum, text=ln, verdict=verdict, issues=issues))
-        cnum += 1
-    return findings
+        m = _ILLEGAL_ANY_RE.search(ln)
+        if m:
+            hit = int(m.lastgroup[1:])
+            for i in range(hit + 1):
+                rx, msg, sev = ILLEGAL_PATTERNS[i]
+                if i == hit or rx.search(ln):
+                    verdict = sev
+                    issues = msg
+                    break
+            any_fail = any_fail or verdict == "fail"
+        append(ClauseFinding(clause_no=cnum, text=ln, verdict=verdict, issues=issues))
+    return findings, any_fail
 
 
 def check_notice_window(renewal: Optional[date], notice_sent: Optional[date]) -> Tuple[str, str]:
@@ -524,12 +970,16 @@ def run_audit(
     ai_api_key: Optional[str] = None,
     ai_articles_csv_path: Optional[str] = None,
     ai_articles_memory: Optional[List[str]] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    ai_concurrency: int = AI_MAX_CONCURRENCY,
 ) -> AuditResult:
     """
     Evaluate the contract text and Ejari fields for compliance signals.
+    `progress(done, total)` is called as each AI clause check completes;
+    `ai_concurrency` caps how many Gemini requests are in flight at once.
     """
-    # Clause scans (regex layer)
-    clause_findings = scan_clauses(contract_text)
+    # Clause scans (regex layer); any_fail is kept up to date by the AI layer below
+    clause_findings, any_fail = _scan_clauses(contract_text)
 
     # Rent math
     proposed_pct = compute_proposed_increase_pct(ejari.current_annual_rent_aed, ejari.proposed_new_rent_aed or ejari.current_annual_rent_aed)
@@ -538,6 +988,7 @@ def run_audit(
 
     issues: List[str] = []
     text_findings: List[str] = []
+    ai_errors = 0
 
     # Proposed increase vs allowed
     if proposed_pct > max_allowed_pct + 1e-6:
@@ -560,16 +1011,45 @@ def run_audit(
         elif ai_articles_csv_path and os.path.exists(ai_articles_csv_path):
             articles = read_articles_texts_from_csv(ai_articles_csv_path)
 
+        article_index = _build_article_index(articles)
+        articles_digest = _articles_digest(articles)
+
+        def _judge(cf: ClauseFinding) -> Tuple[str, str, List[int]]:
+            return _gemini_check_clause_against_articles(
+                cf.text, articles, api_key, start_index=0,
+                article_index=article_index, articles_digest=articles_digest,
+            )
+
+        # Fan the per-clause requests out; results are applied in clause order below.
+        total = len(clause_findings)
+        ai_results: List[Tuple[str, str, List[int]]] = [("pass", "", [])] * total
+        workers = max(1, min(ai_concurrency, total))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_judge, cf): idx for idx, cf in enumerate(clause_findings)}
+            for done, fut in enumerate(as_completed(futures), start=1):
+                ai_results[futures[fut]] = fut.result()
+                if progress is not None:
+                    progress(done, total)
+
         ai_any_fail = False
         ai_refs_by_clause: Dict[int, List[int]] = {}
-        for idx, cf in enumerate(clause_findings):
-            verdict, reason, refs = _gemini_check_clause_against_articles(cf.text, articles, api_key, start_index=0)
-            if verdict == "fail":
+        for idx, (cf, (verdict, reason, refs)) in enumerate(zip(clause_findings, ai_results)):
+            if verdict == "warn":
+                # AI check errored: never report the clause as AI-cleared
+                ai_errors += 1
+                clause_findings[idx] = ClauseFinding(
+                    clause_no=cf.clause_no,
+                    text=cf.text,
+                    verdict="warn" if cf.verdict == "pass" else cf.verdict,
+                    issues=(cf.issues + "; " if cf.issues else "") + f"AI not checked: {reason}",
+                )
+            elif verdict == "fail":
                 ai_any_fail = True
                 if refs:
                     ai_refs_by_clause[idx] = refs
                 # annotate this clause if regex didn't already fail
                 if cf.verdict == "pass":
+                    any_fail = True
                     clause_findings[idx] = ClauseFinding(
                         clause_no=cf.clause_no,
                         text=cf.text,
@@ -581,9 +1061,13 @@ def run_audit(
                     clause_findings[idx].issues = (clause_findings[idx].issues + "; " if clause_findings[idx].issues else "") + f"AI: {reason}" + (f" | Refs: {refs}" if refs else "")
         if ai_any_fail:
             issues.append("AI layer flagged one or more clauses as non-compliant.")
+        if ai_errors:
+            issues.append(
+                f"AI layer could not check {ai_errors} of {total} clause(s) (request errors); "
+                "those clauses were only checked by the rule-based scan."
+            )
 
     # Aggregate clause findings → any "fail" makes overall fail
-    any_fail = any(cf.verdict == "fail" for cf in clause_findings)
     if any_fail:
         issues.append("One or more clauses are non-compliant (see table).")
 
@@ -601,20 +1085,30 @@ def run_audit(
         notes=[],
         contract_text=contract_text,
         timestamp=now_iso(),
+        ai_errors=ai_errors,
     )
 
 
 # ----------------------------- Firestore (Admin) ---------------------------
 _firebase_ready = False
 _firestore = None  # lazy
+_agreements_col = None  # cached "agreements" collection ref (reused across reruns)
+
+# Ledger commits are retried on transient server errors (contention / unavailable
+# / deadline); the writes are idempotent since the ledger doc id is fixed up front.
+LEDGER_MAX_RETRIES = 5
+LEDGER_BACKOFF_BASE_S = 0.1
 
 
 def firebase_init_from_mapping(cfg: Dict[str, Any]) -> None:
     """
     Initialize Firebase Admin from a dict (Streamlit `st.secrets["firebase"]` is perfect).
-    Safe to call multiple times.
+    Safe to call multiple times: once a client exists it is reused as-is (the
+    Admin app only ever binds the first credentials anyway).
     """
-    global _firebase_ready, _firestore
+    global _firebase_ready, _firestore, _agreements_col
+    if firebase_available():
+        return
     try:
         import firebase_admin  # type: ignore
         from firebase_admin import credentials, firestore  # type: ignore
@@ -623,6 +1117,7 @@ def firebase_init_from_mapping(cfg: Dict[str, Any]) -> None:
             cred = credentials.Certificate(cfg)  # type: ignore
             firebase_admin.initialize_app(cred)
         _firestore = firestore.client()
+        _agreements_col = _firestore.collection("agreements")
         _firebase_ready = True
     except Exception as e:
         _firebase_ready = False
@@ -671,9 +1166,16 @@ def write_ledger(
 
     db: Client = _firestore  # type: ignore
 
-    # Deterministic agreement id:
-    seed = (audit.contract_text or "").encode("utf-8") + (landlord or "").encode("utf-8") + (tenant or "").encode("utf-8")
-    agreement_id = _sha256_hex(seed)[:32]
+    # Encode / hash each buffer exactly once and reuse the digests below.
+    ct_hasher = hashlib.sha256((audit.contract_text or "").encode("utf-8"))
+    contract_text_hash = ct_hasher.copy().hexdigest()
+    pdf_sha256 = _sha256_hex(pdf_bytes) if pdf_bytes else None
+
+    # Deterministic agreement id: sha256(contract_text + landlord + tenant), fed
+    # incrementally on top of the contract-text state instead of concatenating.
+    ct_hasher.update((landlord or "").encode("utf-8"))
+    ct_hasher.update((tenant or "").encode("utf-8"))
+    agreement_id = ct_hasher.hexdigest()[:32]
 
     doc = {
         "timestamp": audit.timestamp,
@@ -689,15 +1191,29 @@ def write_ledger(
             "text_findings": audit.text_findings,
             "clause_findings": [asdict(c) for c in audit.clause_findings],
         },
-        "contract_text_hash": _sha256_hex((audit.contract_text or "").encode("utf-8")),
-        "pdf_sha256": _sha256_hex(pdf_bytes) if pdf_bytes else None,
+        "contract_text_hash": contract_text_hash,
+        "pdf_sha256": pdf_sha256,
         "version": 1,
     }
 
-    # Write:
-    agreements = db.collection("agreements")
-    agreements.document(agreement_id).set({"created_at": audit.timestamp}, merge=True)
-    ledger_ref = agreements.document(agreement_id).collection("ledger").document()
-    ledger_ref.set(doc)
+    from google.api_core import exceptions as gexc  # type: ignore
+
+    # Write both documents in one atomic batch (a single commit round-trip):
+    agreements = _agreements_col if _agreements_col is not None else db.collection("agreements")  # type: ignore
+    agreement_ref = agreements.document(agreement_id)
+    ledger_ref = agreement_ref.collection("ledger").document()
+
+    def _commit() -> None:
+        batch = db.batch()
+        batch.set(agreement_ref, {"created_at": audit.timestamp}, merge=True)
+        batch.set(ledger_ref, doc)
+        batch.commit()
+
+    _retry_with_backoff(
+        _commit,
+        retries=LEDGER_MAX_RETRIES,
+        base_delay=LEDGER_BACKOFF_BASE_S,
+        retry_on=(gexc.Aborted, gexc.ServiceUnavailable, gexc.DeadlineExceeded),
+    )
 
     return agreement_id
\ No newline at end of file